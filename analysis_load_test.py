@@ -0,0 +1,85 @@
+"""Load generator that reports throughput and tail latency of /analyze."""
+import json
+import argparse
+import urllib.error
+import urllib.request
+import numpy as np
+from time import perf_counter
+from concurrent.futures import ThreadPoolExecutor
+
+
+def post_image(server, image_url):
+    """Posts one image URL to the server and returns the latency.
+
+    Args:
+        server (str): Address of the web app, e.g. http://localhost:5000.
+        image_url (str): URL of the image to analyze.
+
+    Returns:
+        tuple: (seconds, error). The round trip time and the HTTP status
+            or reason of a failed request, None if it succeeded.
+
+    """
+    body = json.dumps({'url': image_url}).encode()
+    req = urllib.request.Request(server + '/analyze', data=body,
+                                 headers={'Content-Type': 'application/json'})
+    start = perf_counter()
+    try:
+        urllib.request.urlopen(req).read()
+    except urllib.error.HTTPError as e:
+        e.close()
+        return perf_counter() - start, e.code
+    except urllib.error.URLError as e:
+        return perf_counter() - start, str(e.reason)
+    return perf_counter() - start, None
+
+
+def main(server, image_url, n, concurrency):
+    """Sends `n` requests using `concurrency` parallel clients.
+
+    Args:
+        server (str): Address of the web app.
+        image_url (str): URL of the image to analyze.
+        n (int): Total number of requests.
+        concurrency (int): Number of requests in flight at once.
+
+    """
+    start = perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        results = list(executor.map(lambda _: post_image(server, image_url),
+                                    range(n)))
+    elapsed = perf_counter() - start
+    latencies = [latency for latency, error in results if error is None]
+    errors = {}
+    for _, error in results:
+        if error is not None:
+            errors[error] = errors.get(error, 0) + 1
+
+    print('Requests:   {}'.format(n))
+    print('Throughput: {:.1f} req/s'.format(len(latencies) / elapsed))
+    print('Errors:     {:.1f} % {}'.format(
+        100 * (n - len(latencies)) / n, errors if errors else ''))
+    if latencies:
+        p50, p95, p99 = np.percentile(np.array(latencies) * 1000,
+                                      [50, 95, 99])
+        print('Latency:    p50 {:.1f} ms, p95 {:.1f} ms, p99 {:.1f} ms'\
+              .format(p50, p95, p99))
+    stats = json.loads(urllib.request.urlopen(
+        server + '/analyze/stats').read())['data']
+    print('Server:     {}'.format(stats))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load tests the /analyze '\
+                                     'route of the web app')
+    parser.add_argument('image', metavar='URL',
+                        help='url of the image to analyze')
+    parser.add_argument('--server', default='http://localhost:5000',
+                        help='address of the web app')
+    parser.add_argument('-n', '--requests', metavar='NUMBER', type=int,
+                        default=100, help='total number of requests')
+    parser.add_argument('-c', '--concurrency', metavar='NUMBER', type=int,
+                        default=8, help='number of parallel clients')
+
+    args = parser.parse_args()
+    main(args.server, args.image, args.requests, args.concurrency)
@@ -0,0 +1,524 @@
+import threading
+import itertools
+import urllib.error
+import urllib.parse
+import urllib.request
+import numpy as np
+from io import BytesIO
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from multiprocessing import Pipe, Process, resource_tracker
+from multiprocessing.connection import wait
+from multiprocessing.shared_memory import SharedMemory
+from time import perf_counter, sleep
+
+
+class _RedirectHandler(urllib.request.HTTPRedirectHandler):
+    """Follows redirects to http and https URLs only."""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        if urllib.parse.urlparse(newurl).scheme not in ('http', 'https'):
+            raise urllib.error.HTTPError(newurl, code, 'Redirect to an '\
+                                         'unsupported URL', headers, fp)
+        return super().redirect_request(req, fp, code, msg, headers, newurl)
+
+
+_opener = urllib.request.build_opener(_RedirectHandler)
+
+
+def fetch_image(url, timeout=10, max_bytes=10*1024*1024):
+    """Downloads an encoded image.
+
+    Args:
+        url (str): http or https URL of the image.
+        timeout (float): Seconds to wait for the server to respond.
+        max_bytes (int): Size in bytes of the largest image accepted.
+
+    Returns:
+        bytes: The encoded image.
+
+    Raises:
+        ValueError: If the URL is not http or https or the image is too
+            large.
+
+    """
+    if urllib.parse.urlparse(url).scheme not in ('http', 'https'):
+        raise ValueError('Only http and https URLs are supported.')
+    with _opener.open(url, timeout=timeout) as response:
+        data = response.read(max_bytes + 1)
+    if len(data) > max_bytes:
+        raise ValueError('Image is larger than {} bytes.'.format(max_bytes))
+    return data
+
+
+def _analyze(job):
+    """Computes the background color and palette of a single image.
+
+    Args:
+        job (tuple): (source, k, color_tol, image_processing_size) where
+            `source` is the encoded image bytes or a (name, shape, dtype)
+            tuple of an image in shared memory.
+
+    Returns:
+        dict: The color and palette, or an error message if the image
+            could not be analyzed.
+
+    """
+    from PIL import Image
+    from spotify_background_color import SpotifyBackgroundColor
+    source, k, color_tol, size = job
+    shm = None
+    try:
+        if isinstance(source, tuple):
+            name, shape, dtype = source
+            shm = SharedMemory(name=name)
+            img = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        else:
+            img = np.array(Image.open(BytesIO(source)).convert('RGB'))
+        background_color = SpotifyBackgroundColor(
+            img=img, image_processing_size=size)
+        r, g, b = background_color.best_color(k=k, color_tol=color_tol)
+        palette = [{'r': r_, 'g': g_, 'b': b_, 'percent': percent}
+                   for r_, g_, b_, percent in background_color.palette()]
+    except Exception as e:
+        return {'error': str(e)}
+    finally:
+        # Drop all views of the shared memory before closing it
+        img = background_color = None
+        if shm is not None:
+            shm.close()
+    return {'r': int(r), 'g': int(g), 'b': int(b), 'palette': palette}
+
+
+def _worker_loop(conn):
+    """Analyzes batches of images until told to stop.
+
+    Every batch arrives as one message and the result of every image is
+    sent back as soon as it is done.
+
+    Args:
+        conn (Connection): Channel used for batches and results.
+
+    """
+    import sklearn.cluster
+    import spotify_background_color
+    while True:
+        try:
+            batch = conn.recv()
+        except EOFError:
+            break
+        if batch is None:
+            break
+        for job_id, job in batch:
+            conn.send((job_id, _analyze(job)))
+
+
+class AnalysisPool():
+    """Pool of warm worker processes that analyzes artwork in batches.
+
+    Requests arriving within `max_wait` seconds of each other are
+    collected into a micro-batch, which is split over the idle workers
+    with one message per worker. A worker returns the result of every
+    image as soon as it is done, so an image does not wait for the rest
+    of its batch.
+
+    URLs are downloaded by threads of this process before they are
+    queued, so a slow server never blocks a worker. Other processes,
+    such as the forked Spotify loop of the web app, analyze images
+    through a client from `connect`. Every client has a shared memory
+    slot of its own which the workers read without copying, and its
+    requests are dispatched before queued uploads and URLs, so a busy
+    `/analyze` endpoint does not hold back track changes.
+
+    Attributes:
+        processes (int): Number of worker processes.
+        max_batch_size (int): Maximum number of images per batch.
+        max_wait (float): Seconds to wait for more requests before a
+            batch is dispatched.
+        k (int): Number of clusters to form.
+        color_tol (float): Tolerance for a colorful color.
+        image_processing_size (tuple): Size the images are resized to.
+        fetch_timeout (float): Seconds to wait for an image server.
+        capacity (int): Size in bytes of the largest image accepted from
+            a client.
+
+    """
+
+    def __init__(self, processes=2, max_batch_size=8, max_wait=0.01,
+                 k=8, color_tol=0, image_processing_size=(100, 100),
+                 fetch_timeout=10, capacity=640*640*4, history=1000):
+        """Starts the worker processes and the batching thread.
+
+        Args:
+            processes (int): Number of worker processes.
+            max_batch_size (int): Maximum number of images per batch.
+            max_wait (float): Seconds to wait for more requests before
+                a batch is dispatched.
+            k (int): Number of clusters to form.
+            color_tol (float): Tolerance for a colorful color.
+            image_processing_size (tuple): Size the images are resized
+                to before clustering.
+            fetch_timeout (float): Seconds to wait for an image server.
+            capacity (int): Size in bytes of the largest image accepted
+                from a client. The default fits the largest Spotify
+                artwork.
+            history (int): Number of latencies kept for the statistics.
+
+        """
+        self.processes = processes
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.k = k
+        self.color_tol = color_tol
+        self.image_processing_size = image_processing_size
+        self.fetch_timeout = fetch_timeout
+        self.capacity = capacity
+
+        self._cond = threading.Condition()
+        self._priority = deque()
+        self._queue = deque()
+        self._pending = {}
+        self._job_ids = itertools.count()
+        self._workers = [None] * processes
+        self._conns = [None] * processes
+        self._busy = [0] * processes
+        self._closed = False
+        # Share the tracker of the client slots with the workers, which
+        # would otherwise report the slots they read as leaked
+        resource_tracker.ensure_running()
+        for worker in range(processes):
+            self._start_worker(worker)
+
+        self._latencies = deque(maxlen=history)
+        self._batch_sizes = deque(maxlen=history)
+        self._completions = deque(maxlen=history)
+        self._completed = 0
+        self._started = None
+        self._connections = {}
+        self._fetcher = ThreadPoolExecutor(max_workers=4 * processes)
+        for target in (self._batch_loop, self._result_loop,
+                       self._client_loop):
+            threading.Thread(target=target, daemon=True).start()
+
+    def _start_worker(self, worker):
+        """Starts the worker process in slot `worker`."""
+        conn, child_conn = Pipe()
+        process = Process(target=_worker_loop, args=(child_conn,),
+                          daemon=True)
+        process.start()
+        # Only the worker keeps its end, so its death closes the pipe
+        child_conn.close()
+        self._workers[worker] = process
+        self._conns[worker] = conn
+
+    def submit(self, source, is_url=True):
+        """Queues an image for analysis.
+
+        Args:
+            source (str/bytes): Image URL or encoded image bytes.
+            is_url (bool): True if `source` is a URL.
+
+        Returns:
+            Future: Resolves to the result dict of the analysis.
+
+        """
+        future = Future()
+        submitted = perf_counter()
+        with self._cond:
+            if self._started is None:
+                self._started = submitted
+        if not is_url:
+            self._enqueue(source, future, submitted)
+            return future
+
+        def on_fetched(fetch):
+            try:
+                data = fetch.result()
+            except Exception as e:
+                future.set_result({'error': str(e)})
+            else:
+                self._enqueue(data, future, submitted)
+
+        self._fetcher.submit(fetch_image, source, self.fetch_timeout) \
+            .add_done_callback(on_fetched)
+        return future
+
+    def _enqueue(self, source, future, submitted, priority=False):
+        """Queues a downloaded or decoded image for the workers."""
+        job = (source, self.k, self.color_tol, self.image_processing_size)
+        with self._cond:
+            queue = self._priority if priority else self._queue
+            queue.append((next(self._job_ids), job, future, submitted))
+            self._cond.notify_all()
+
+    def analyze(self, source, is_url=True, timeout=None):
+        """Analyzes an image and waits for the result.
+
+        Args:
+            source (str/bytes): Image URL or encoded image bytes.
+            is_url (bool): True if `source` is a URL.
+            timeout (float): Seconds to wait for the result.
+
+        Returns:
+            dict: The color and palette of the image.
+
+        """
+        return self.submit(source, is_url).result(timeout)
+
+    def connect(self):
+        """Returns a client for analyzing images from another process.
+
+        Start the other process with the client and close the client in
+        this one. Every process gets a connection and a shared memory
+        slot of its own, so a process that is terminated mid-request
+        only breaks its own connection. The slot is released when the
+        connection is closed in every process.
+
+        Returns:
+            AnalysisClient: The client for the other process.
+
+        """
+        parent_conn, child_conn = Pipe()
+        shm = SharedMemory(create=True, size=self.capacity)
+        with self._cond:
+            self._connections[parent_conn] = shm
+        return AnalysisClient(child_conn, shm)
+
+    def _client_loop(self):
+        """Queues images received from other processes with priority."""
+        while True:
+            with self._cond:
+                connections = list(self._connections)
+            if not connections:
+                sleep(0.5)
+                continue
+            # Time out to pick up connections added meanwhile
+            for conn in wait(connections, timeout=0.5):
+                try:
+                    request_id, shape, dtype = conn.recv()
+                except (EOFError, OSError):
+                    with self._cond:
+                        shm = self._connections.pop(conn)
+                    conn.close()
+                    shm.close()
+                    shm.unlink()
+                    continue
+                future = Future()
+                future.add_done_callback(
+                    lambda future, conn=conn, request_id=request_id:
+                    self._reply(conn, request_id, future))
+                self._enqueue((self._connections[conn].name, shape, dtype),
+                              future, perf_counter(), priority=True)
+
+    def _reply(self, conn, request_id, future):
+        """Sends the result of an analysis back to another process."""
+        try:
+            conn.send((request_id, future.result()))
+        except Exception:
+            # The other process is gone
+            pass
+
+    def _batch_loop(self):
+        """Collects queued requests into batches and dispatches them."""
+        while True:
+            with self._cond:
+                while not ((self._priority or self._queue) and
+                           0 in self._busy):
+                    self._cond.wait()
+                if self._priority:
+                    batch = list(self._priority)
+                    self._priority.clear()
+                else:
+                    deadline = perf_counter() + self.max_wait
+                    while len(self._queue) < self.max_batch_size and \
+                            not self._priority:
+                        remaining = deadline - perf_counter()
+                        if remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+                    if self._priority:
+                        continue
+                    batch = [self._queue.popleft() for _ in range(
+                        min(len(self._queue), self.max_batch_size))]
+                self._batch_sizes.append(len(batch))
+                self._dispatch(batch)
+
+    def _dispatch(self, batch):
+        """Splits a batch over the idle workers, one message per worker.
+
+        Must be called with the lock held.
+
+        """
+        idle = [worker for worker, busy in enumerate(self._busy)
+                if not busy]
+        for i, worker in enumerate(idle[:len(batch)]):
+            chunk = batch[i::len(idle)]
+            for job_id, job, future, submitted in chunk:
+                self._pending[job_id] = (future, submitted, worker)
+            self._busy[worker] = len(chunk)
+            try:
+                self._conns[worker].send([(job_id, job) for
+                                          job_id, job, _, _ in chunk])
+            except OSError:
+                # The result thread notices the dead worker
+                pass
+
+    def _result_loop(self):
+        """Resolves the futures of finished images."""
+        while True:
+            with self._cond:
+                conns = list(self._conns)
+            for conn in wait(conns, timeout=0.5):
+                worker = conns.index(conn)
+                try:
+                    job_id, result = conn.recv()
+                except (EOFError, OSError):
+                    if self._closed:
+                        return
+                    self._restart_worker(worker)
+                    continue
+                with self._cond:
+                    future, submitted, _ = self._pending.pop(job_id)
+                    self._busy[worker] -= 1
+                    now = perf_counter()
+                    self._latencies.append(now - submitted)
+                    self._completions.append(now)
+                    self._completed += 1
+                    self._cond.notify_all()
+                future.set_result(result)
+
+    def _restart_worker(self, worker):
+        """Fails the images of a dead worker and starts a new one."""
+        with self._cond:
+            lost = [job_id for job_id, (_, _, pending_worker)
+                    in self._pending.items() if pending_worker == worker]
+            futures = [self._pending.pop(job_id)[0] for job_id in lost]
+            self._conns[worker].close()
+            self._workers[worker].join()
+            self._start_worker(worker)
+            self._busy[worker] = 0
+            self._cond.notify_all()
+        for future in futures:
+            future.set_result({'error': 'The worker process died.'})
+
+    def stats(self, window=60):
+        """Returns throughput and latency statistics.
+
+        Args:
+            window (float): Seconds the throughput is measured over.
+
+        Returns:
+            dict: Completed requests, throughput in requests per second
+                over the last `window` seconds, mean batch size and
+                p50/p95/p99 latencies in milliseconds.
+
+        """
+        now = perf_counter()
+        with self._cond:
+            latencies = np.array(self._latencies) * 1000
+            batch_sizes = list(self._batch_sizes)
+            recent = sum(1 for completion in self._completions
+                         if now - completion <= window)
+            completed = self._completed
+            started = self._started
+        stats = {'completed': completed, 'throughput': 0.0,
+                 'mean_batch_size': 0.0, 'p50_ms': None, 'p95_ms': None,
+                 'p99_ms': None}
+        if started is not None and recent:
+            stats['throughput'] = recent / min(window, now - started)
+        if batch_sizes:
+            stats['mean_batch_size'] = float(np.mean(batch_sizes))
+        if len(latencies):
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+            stats.update(p50_ms=float(p50), p95_ms=float(p95),
+                         p99_ms=float(p99))
+        return stats
+
+    def close(self):
+        """Stops the worker processes."""
+        self._fetcher.shutdown(wait=False)
+        with self._cond:
+            self._closed = True
+            for process in self._workers:
+                process.terminate()
+                process.join()
+            for conn, shm in self._connections.items():
+                conn.close()
+                shm.close()
+                shm.unlink()
+            self._connections.clear()
+
+
+class AnalysisClient():
+    """Analyzes images through an `AnalysisPool` in another process.
+
+    The image is copied into the shared memory slot of the client, so
+    only a small request tuple is pickled per image.
+
+    Attributes:
+        conn (Connection): Connection to the pool.
+        shm (SharedMemory): Slot the images are handed over in.
+
+    """
+
+    def __init__(self, conn, shm):
+        self.conn = conn
+        self.shm = shm
+        self._ids = itertools.count()
+
+    def best_color(self, img, timeout=None):
+        """Returns the background color computed by the pool.
+
+        Args:
+            img (ndarray): The image to analyze.
+            timeout (float): Seconds to wait for the result.
+
+        Returns:
+            tuple: (R, G, B). The calculated background color.
+
+        Raises:
+            ValueError: If `img` is larger than the slot.
+            AnalysisTimeoutException: If no result arrived in time.
+            AnalysisFailedException: If the image could not be analyzed.
+
+        """
+        img = np.ascontiguousarray(img)
+        if img.nbytes > self.shm.size:
+            raise ValueError('Image of {} bytes does not fit in the shared '\
+                             'memory of {} bytes.'.format(img.nbytes,
+                                                          self.shm.size))
+        request_id = next(self._ids)
+        # A worker may still read the image of a request that timed out,
+        # its late result is skipped below
+        buf = np.ndarray(img.shape, dtype=img.dtype, buffer=self.shm.buf)
+        buf[...] = img
+        del buf
+        self.conn.send((request_id, img.shape, img.dtype.str))
+        deadline = None if timeout is None else perf_counter() + timeout
+        while True:
+            remaining = None if deadline is None else \
+                max(deadline - perf_counter(), 0)
+            if not self.conn.poll(remaining):
+                raise AnalysisTimeoutException('Analysis timed out.')
+            reply_id, result = self.conn.recv()
+            # Skip late results of requests that timed out
+            if reply_id == request_id:
+                break
+        if 'error' in result:
+            raise AnalysisFailedException(result['error'])
+        return result['r'], result['g'], result['b']
+
+    def close(self):
+        """Closes the connection and the slot in this process."""
+        self.conn.close()
+        self.shm.close()
+
+
+class AnalysisTimeoutException(Exception):
+    """Raises when the pool did not answer in time."""
+    pass
+
+
+class AnalysisFailedException(Exception):
+    """Raises when the pool could not analyze an image."""
+    pass
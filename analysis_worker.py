@@ -0,0 +1,182 @@
+import os
+import threading
+import itertools
+import numpy as np
+from time import perf_counter
+from multiprocessing import Pipe, Process
+from multiprocessing.shared_memory import SharedMemory
+from spotify_background_color import SpotifyBackgroundColor, lab_lookup_table
+
+
+def _worker_loop(conn, shm_name, lab):
+    """Analyzes images placed in shared memory until told to stop.
+
+    Args:
+        conn (Connection): Channel used for requests and results.
+        shm_name (str): Name of the shared memory block with the images.
+        lab (bool): Build the Lab lookup table before the first image.
+
+    """
+    if lab:
+        lab_lookup_table()
+    shm = SharedMemory(name=shm_name)
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            break
+        if request is None:
+            break
+        request_id, shape, dtype, k, color_tol, size, color_space = request
+        img = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        background_color = None
+        try:
+            background_color = SpotifyBackgroundColor(
+                img=img, image_processing_size=size)
+            r, g, b = background_color.best_color(
+                k=k, color_tol=color_tol, color_space=color_space)
+            reply = (request_id, (float(r), float(g), float(b)), None)
+        except Exception as e:
+            reply = (request_id, None, repr(e))
+        # Drop all views of the shared memory before it is reused
+        del img, background_color
+        conn.send(reply)
+    shm.close()
+
+
+class AnalysisWorker():
+    """Persistent process that computes background colors.
+
+    The worker imports the clustering stack once at start. Images are
+    handed over by copying them into a shared memory block which the
+    worker reads without copying, so only a small request tuple is
+    pickled per image. If the worker dies or does not answer within
+    `timeout` seconds, it is restarted and the image is analyzed in the
+    calling process instead.
+
+    Attributes:
+        process (Process): The worker process.
+        capacity (int): Size in bytes of the largest image accepted.
+        timeout (float): Seconds to wait for a result.
+        lab (bool): True if the worker builds the Lab lookup table at
+            start.
+
+    """
+
+    def __init__(self, capacity=640*640*4, timeout=30, lab=False):
+        """Allocates the shared memory and starts the worker process.
+
+        Args:
+            capacity (int): Size in bytes of the largest image accepted.
+                The default fits the largest Spotify artwork.
+            timeout (float): Seconds to wait for a result.
+            lab (bool): Build the Lab lookup table when the worker
+                starts, for clustering in the Lab color space.
+
+        """
+        self.capacity = capacity
+        self.timeout = timeout
+        self.lab = lab
+        self._shm = SharedMemory(create=True, size=capacity)
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+        self._start()
+
+    def _start(self):
+        """Starts the worker process."""
+        self._conn, child_conn = Pipe()
+        self.process = Process(target=_worker_loop,
+                               args=(child_conn, self._shm.name, self.lab),
+                               daemon=True)
+        self.process.start()
+        # Only the worker keeps its end, so its death closes the pipe
+        child_conn.close()
+
+    def _restart(self):
+        """Replaces a dead or stuck worker process."""
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join()
+        self._conn.close()
+        self._start()
+
+    def best_color(self, img, k=8, color_tol=10, image_processing_size=None,
+                   color_space='RGB'):
+        """Returns a suitable background color computed by the worker.
+
+        Has the same result as `SpotifyBackgroundColor.best_color`.
+
+        Args:
+            img (ndarray): The image to analyze in RGB format.
+            k (int): Number of clusters to form.
+            color_tol (float): Tolerance for a colorful color.
+            image_processing_size (tuple): Size of the image used for
+                the analysis.
+            color_space (str): Color space to cluster in, either RGB
+                or Lab.
+
+        Returns:
+            tuple: (R, G, B). The calculated background color.
+
+        Raises:
+            ValueError: If `img` is larger than the capacity.
+            AnalysisWorkerException: If the analysis failed.
+
+        """
+        img = np.ascontiguousarray(img)
+        if img.nbytes > self.capacity:
+            raise ValueError('Image of {} bytes does not fit in the shared '\
+                             'memory of {} bytes.'.format(img.nbytes,
+                                                          self.capacity))
+        # Tag requests with the pid since the worker may be shared with
+        # forked processes that are terminated before reading a result
+        request_id = (os.getpid(), next(self._ids))
+        reply_id = None
+        with self._lock:
+            buf = np.ndarray(img.shape, dtype=img.dtype, buffer=self._shm.buf)
+            buf[...] = img
+            del buf
+            deadline = perf_counter() + self.timeout
+            try:
+                self._conn.send((request_id, img.shape, img.dtype.str, k,
+                                 color_tol, image_processing_size,
+                                 color_space))
+                while reply_id != request_id and self._conn.poll(
+                        max(deadline - perf_counter(), 0)):
+                    reply_id, color, error = self._conn.recv()
+            except (EOFError, OSError):
+                pass
+            if reply_id != request_id:
+                print('Analysis worker died or timed out, restarting it')
+                self._restart()
+        if reply_id != request_id:
+            background_color = SpotifyBackgroundColor(
+                img=img, image_processing_size=image_processing_size)
+            return background_color.best_color(
+                k=k, color_tol=color_tol, color_space=color_space)
+        if error:
+            raise AnalysisWorkerException(error)
+        return color
+
+    def close(self):
+        """Stops the worker process and releases the shared memory.
+
+        Also works if the worker process has died.
+
+        """
+        try:
+            self._conn.send(None)
+        except OSError:
+            pass
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self._conn.close()
+        self._shm.close()
+        self._shm.unlink()
+
+
+class AnalysisWorkerException(Exception):
+    """Raises when the worker could not analyze an image."""
+    pass
@@ -2,10 +2,13 @@ from flask import Flask, jsonify, render_template, request
 import os
 from time import sleep
 from multiprocessing import Process
+from concurrent.futures import wait
 import configparser
-from spotify_background_color import SpotifyBackgroundColor
 from current_spotify_playback import CurrentSpotifyPlayback, NoArtworkException
 from led_controller import LEDController
+from analysis_pool import AnalysisPool, AnalysisTimeoutException, \
+    AnalysisFailedException
+from loop_profiler import LoopProfiler
 
 
 app = Flask(__name__)
@@ -25,18 +28,25 @@ def main():
 def spotify():
     global p
     if not p.is_alive():
-        p = Process(target=main_spotify, args=())
+        client = analysis_pool.connect()
+        p = Process(target=main_spotify, args=(client,))
         p.start()
+        # Only the Spotify process keeps the client open
+        client.close()
     return render_template('spotify.html')
 
 
+def stop_main_spotify():
+    """Terminates the Spotify process and stops a fade it started."""
+    if p.is_alive():
+        p.terminate()
+        p.join()
+    led.stop_fade()
+
+
 @app.route('/manual')
 def manual():
-    global p
-    try:
-        p.terminate()
-    except AttributeError:
-        pass
+    stop_main_spotify()
     return render_template('manual.html')
 
 
@@ -56,28 +66,71 @@ def color():
 
 @app.route('/off')
 def off():
-    global p
-    try:
-        p.terminate()
-    except AttributeError:
-        pass
+    stop_main_spotify()
     led.set_color(0, 0, 0)
     return render_template('off.html')
 
 
-def main_spotify():
+@app.route('/analyze', methods=['POST'])
+def analyze():
+    if 'image' in request.files:
+        futures = [analysis_pool.submit(f.read(), is_url=False)
+                   for f in request.files.getlist('image')]
+    else:
+        data = request.get_json(silent=True) or {}
+        urls = data.get('urls') or [data.get('url')]
+        if not all(urls):
+            return jsonify(status='error',
+                           data='Expected an image url or upload.'), 400
+        futures = [analysis_pool.submit(url) for url in urls]
+    # A stuck analysis never resolves its future, so do not wait forever
+    _, not_done = wait(futures, timeout=analysis_timeout)
+    if not_done:
+        return jsonify(status='error', data='Analysis timed out.'), 504
+    results = [future.result() for future in futures]
+    if all('error' in result for result in results):
+        return jsonify(status='error', data=results), 422
+    return jsonify(status='analyzed', data=results)
+
+
+@app.route('/analyze/stats')
+def analyze_stats():
+    return jsonify(status='stats', data=analysis_pool.stats())
+
+
+@app.route('/profile', methods=['GET', 'POST'])
+def profile():
+    if request.method == 'POST':
+        if profiler.is_enabled():
+            profiler.disable()
+        else:
+            data = request.get_json(silent=True) or {}
+            tracks = data.get('tracks')
+            seconds = data.get('seconds')
+            # Never leave the profiler running unbounded
+            if not tracks and not seconds:
+                tracks = 5
+            profiler.enable(tracks=tracks, seconds=seconds)
+    return jsonify(status='profiling' if profiler.is_enabled() else 'idle',
+                   data={'output_dir': profiler.output_dir,
+                         'mode': profiler.mode})
+
+
+def main_spotify(analysis):
     old_song_id = ''
     while True:
+        profiler.begin()
+        track_change = False
         spotify.update_current_playback()
         if spotify.connected_to_chromecast(name):
             if spotify.new_song(old_song_id):
+                track_change = True
                 try:
                     artwork = spotify.get_artwork()
-                    background_color = SpotifyBackgroundColor(
-                        img=artwork, image_processing_size=(100, 100))
-                    r, g, b = background_color.best_color(
-                        k=8, color_tol=0)
-                except NoArtworkException:
+                    r, g, b = analysis.best_color(artwork,
+                                                  timeout=analysis_timeout)
+                except (NoArtworkException, AnalysisTimeoutException,
+                        AnalysisFailedException):
                     r, g, b = 255, 255, 255
                 led.set_color(r, g, b)
                 old_song_id = spotify.get_current_song_id()
@@ -86,6 +139,7 @@ def main_spotify():
             r, g, b = led.get_color()
             if r != 0 or g != 0 or b != 0:
                 led.set_color(0, 0, 0)
+        profiler.end(track_change)
         sleep(2)
 
 
@@ -98,10 +152,21 @@ if __name__ == '__main__':
     blue_pin = int(GPIO_PINS['blue_pin'])
     name = config['CHROMECAST']['name']
 
-    led = LEDController(red_pin, green_pin, blue_pin)
+    daemon_fade = GPIO_PINS.get('daemon_fade') == 'True'
+    led = LEDController(red_pin, green_pin, blue_pin,
+                        daemon_fade=daemon_fade)
     spotify = CurrentSpotifyPlayback(CLIENT_ID, CLIENT_SECRET,
                                      REDIRECT_URI, REFRESH_TOKEN)
 
-    p = Process(target=main_spotify, args=())
+    profiler = LoopProfiler()
+    p = Process(target=main_spotify)
+
+    ANALYSIS = config['ANALYSIS'] if 'ANALYSIS' in config else {}
+    analysis_pool = AnalysisPool(
+        processes=int(ANALYSIS.get('processes', 2)),
+        max_batch_size=int(ANALYSIS.get('max_batch_size', 8)),
+        max_wait=float(ANALYSIS.get('max_wait', 0.01)),
+        fetch_timeout=float(ANALYSIS.get('fetch_timeout', 10)))
+    analysis_timeout = float(ANALYSIS.get('timeout', 30))
 
     app.run(host='0.0.0.0')
@@ -0,0 +1,108 @@
+"""Compares latency and match rate of RGB and Lab clustering."""
+import os
+import json
+import argparse
+import numpy as np
+from time import perf_counter
+from PIL import Image
+from spotify_background_color import SpotifyBackgroundColor, lab_lookup_table
+
+
+def analyze(img, k, color_space, size):
+    """Returns the background color of an image and the time it took.
+
+    Args:
+        img (ndarray): The image to analyze.
+        k (int): Number of clusters to form.
+        color_space (str): Color space to cluster in, either RGB or Lab.
+        size (tuple): Size of the image used for the analysis.
+
+    Returns:
+        tuple: ((R, G, B), seconds).
+
+    """
+    start = perf_counter()
+    background_color = SpotifyBackgroundColor(img=img,
+                                              image_processing_size=size)
+    color = background_color.best_color(k=k, color_tol=0,
+                                        color_space=color_space)
+    return color, perf_counter() - start
+
+
+def main(directory, expected, rgb_k, lab_k, size, tol):
+    """Analyzes every image in `directory` with both color spaces.
+
+    A result matches if it is within `tol` (Euclidean RGB distance) of
+    the expected color of the image. Without expected colors, the Lab
+    results are matched against the RGB results.
+
+    Args:
+        directory (str): Directory with the artworks.
+        expected (dict): Expected (R, G, B) per file name, may be empty.
+        rgb_k (int): Number of clusters used in RGB.
+        lab_k (int): Number of clusters used in Lab.
+        size (tuple): Size of the images used for the analysis.
+        tol (float): Maximum distance of a matching color.
+
+    """
+    start = perf_counter()
+    lab_lookup_table()
+    print('Lab lookup table built in {:.0f} ms'.format(
+        (perf_counter() - start) * 1000))
+
+    results = {'RGB': ([], []), 'Lab': ([], [])}
+    for file_name in sorted(os.listdir(directory)):
+        try:
+            img = np.array(Image.open(os.path.join(directory, file_name))
+                           .convert('RGB'))
+        except OSError:
+            continue
+        rgb_color, rgb_time = analyze(img, rgb_k, 'RGB', size)
+        lab_color, lab_time = analyze(img, lab_k, 'Lab', size)
+        reference = expected.get(file_name, rgb_color if not expected else None)
+        for color_space, color, seconds in (('RGB', rgb_color, rgb_time),
+                                            ('Lab', lab_color, lab_time)):
+            times, matches = results[color_space]
+            times.append(seconds)
+            if reference is not None:
+                matches.append(np.linalg.norm(
+                    np.subtract(color, reference, dtype='float')) <= tol)
+
+    for color_space, k in (('RGB', rgb_k), ('Lab', lab_k)):
+        times, matches = results[color_space]
+        if not times:
+            print('No images found in {}'.format(directory))
+            return
+        times = np.array(times) * 1000
+        line = '{:<4} k = {:<3} mean {:6.1f} ms  p95 {:6.1f} ms'.format(
+            color_space, k, times.mean(), np.percentile(times, 95))
+        if expected or color_space == 'Lab':
+            line += '  match rate {:5.1f} % of {}'.format(
+                100 * np.mean(matches), len(matches))
+        print(line)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compares latency and '\
+                                     'match rate of RGB and Lab clustering')
+    parser.add_argument('directory', help='directory with artworks')
+    parser.add_argument('-e', '--expected', metavar='FILE',
+                        help='json file with the expected [R, G, B] per '\
+                        'file name, otherwise Lab is matched against RGB')
+    parser.add_argument('-k', '--cluster', metavar='NUMBER', type=int,
+                        default=8, help='number of clusters used in RGB')
+    parser.add_argument('-l', '--lab-cluster', metavar='NUMBER', type=int,
+                        default=5, help='number of clusters used in Lab')
+    parser.add_argument('-s', '--size', metavar='SIZE', type=int, nargs='+',
+                        default=(100, 100), help='artwork width and height '\
+                        'to use as a tuple')
+    parser.add_argument('-t', '--tol', metavar='DISTANCE', type=float,
+                        default=20, help='maximum RGB distance of a match')
+
+    args = parser.parse_args()
+    expected = {}
+    if args.expected:
+        with open(args.expected) as json_file:
+            expected = json.load(json_file)
+    main(args.directory, expected, args.cluster, args.lab_cluster,
+         tuple(args.size), args.tol)
@@ -112,9 +112,13 @@ class CurrentSpotifyPlayback():
         else:
             return False
 
-    def get_artwork(self):
+    def get_artwork(self, smallest=False):
         """Returns the album artwork of the current playing song.
 
+        Args:
+            smallest (bool): Fetch the smallest variant of the artwork
+                (usually 64x64) instead of the 300x300 one.
+
         Returns:
             ndarray: Album artwork.
 
@@ -127,7 +131,8 @@ class CurrentSpotifyPlayback():
         """
         if self.data:
             try:
-                url = self.data['item']['album']['images'][1]['url']
+                images = self.data['item']['album']['images']
+                url = images[-1]['url'] if smallest else images[1]['url']
             except IndexError:
                 raise NoArtworkException()
             image_bytes = BytesIO(urllib.request.urlopen(url).read())
@@ -0,0 +1,150 @@
+"""Counts pigpio round trips per fade against a mock pigpio daemon."""
+import re
+import struct
+import argparse
+import threading
+import socketserver
+from time import perf_counter
+from collections import Counter
+from led_controller import LEDController
+
+
+CMD_PWM = 5
+CMD_PROC = 38
+CMD_PROCR = 40
+CMD_PROCP = 45
+CMD_GDC = 83
+CMD_NOIB = 99
+SCRIPT_HALTED = 1
+MAX_SCRIPT_PARAMS = 10
+
+
+class MockPigpioServer(socketserver.ThreadingTCPServer):
+    """Speaks enough of the pigpio socket protocol for LEDController.
+
+    Every command received is one round trip and is counted per
+    command number in `counts`. Scripts are not interpreted, running
+    the fade script sets the pins to its finish color at once.
+
+    Attributes:
+        counts (Counter): Number of round trips per command.
+        dutycycles (dict): Current dutycycle per GPIO pin.
+
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port=0):
+        super().__init__(('localhost', port), _MockPigpioHandler)
+        self.counts = Counter()
+        self.dutycycles = {}
+        self.scripts = []
+        self.lock = threading.Lock()
+
+    def handle_command(self, cmd, p1, p2, ext):
+        """Returns the result and extension of a pigpio command."""
+        with self.lock:
+            self.counts[cmd] += 1
+            if cmd == CMD_PWM:
+                self.dutycycles[p1] = p2
+            elif cmd == CMD_GDC:
+                return self.dutycycles.get(p1, 0), b''
+            elif cmd == CMD_PROC:
+                pins = [int(pin) for pin in
+                        re.findall(r'pwm (\d+)', ext.decode())]
+                self.scripts.append(pins)
+                return len(self.scripts) - 1, b''
+            elif cmd == CMD_PROCR:
+                params = struct.unpack('{}I'.format(len(ext) // 4), ext)
+                for pin, value in zip(self.scripts[p1], params[3:6]):
+                    self.dutycycles[pin] = value
+            elif cmd == CMD_PROCP:
+                status = [SCRIPT_HALTED] + MAX_SCRIPT_PARAMS * [0]
+                ext = struct.pack('11i', *status)
+                return len(ext), ext
+            return 0, b''
+
+    def round_trips(self):
+        """Returns the total number of round trips."""
+        with self.lock:
+            return sum(self.counts.values())
+
+
+class _MockPigpioHandler(socketserver.BaseRequestHandler):
+
+    def _recv(self, n):
+        data = b''
+        while len(data) < n:
+            chunk = self.request.recv(n - len(data))
+            if not chunk:
+                return None
+            data += chunk
+        return data
+
+    def handle(self):
+        while True:
+            header = self._recv(16)
+            if header is None:
+                return
+            cmd, p1, p2, p3 = struct.unpack('IIII', header)
+            ext = self._recv(p3) if p3 else b''
+            if cmd == CMD_NOIB:
+                # Notification socket, keep it open without notifying
+                self.request.sendall(struct.pack('IIII', cmd, p1, p2, 0))
+                self._recv(1)
+                return
+            res, res_ext = self.server.handle_command(cmd, p1, p2, ext)
+            try:
+                self.request.sendall(struct.pack('IIIi', cmd, p1, p2, res)
+                                     + res_ext)
+            except OSError:
+                # The client closed the socket without reading the reply
+                return
+
+
+def benchmark(server, daemon_fade, fades, delay):
+    """Fades between two colors and reports the round trips.
+
+    Args:
+        server (MockPigpioServer): The running mock pigpio daemon.
+        daemon_fade (bool): Run the fades as a pigpio script.
+        fades (int): Number of fades.
+        delay (float): Delay in seconds between each interpolation color.
+
+    Returns:
+        tuple: (round trips per fade, seconds per fade).
+
+    """
+    led = LEDController(17, 22, 24, host='localhost',
+                        port=server.server_address[1],
+                        daemon_fade=daemon_fade)
+    before = server.round_trips()
+    start = perf_counter()
+    for i in range(fades):
+        led.set_color(*((255, 80, 0) if i % 2 == 0 else (0, 80, 255)),
+                      delay=delay)
+    elapsed = perf_counter() - start
+    round_trips = server.round_trips() - before
+    del led
+    return round_trips / fades, elapsed / fades
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Counts pigpio round trips '\
+                                     'per fade against a mock pigpio daemon')
+    parser.add_argument('-n', '--fades', metavar='NUMBER', type=int,
+                        default=10, help='number of fades')
+    parser.add_argument('-d', '--delay', metavar='SECONDS', type=float,
+                        default=0, help='delay between interpolation colors')
+
+    args = parser.parse_args()
+    server = MockPigpioServer()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    for daemon_fade in (False, True):
+        round_trips, seconds = benchmark(server, daemon_fade, args.fades,
+                                         args.delay)
+        print('{:<14} {:6.1f} round trips/fade {:8.1f} ms/fade'.format(
+            'daemon fade:' if daemon_fade else 'socket fade:', round_trips,
+            seconds * 1000))
@@ -1,6 +1,42 @@
 import pigpio
 import numpy as np
+import threading
 from time import sleep
+from multiprocessing import Array
+
+
+# Fades from (p0, p1, p2) to (p3, p4, p5) in p6 + 1 steps with p7 ms
+# between each step. The GPIO pins are filled in per controller.
+FADE_SCRIPT = '''
+ld v0 0
+tag 0
+lda p3
+sub p0
+mlt v0
+div p6
+add p0
+sta v1
+pwm {red_pin} v1
+lda p4
+sub p1
+mlt v0
+div p6
+add p1
+sta v1
+pwm {green_pin} v1
+lda p5
+sub p2
+mlt v0
+div p6
+add p2
+sta v1
+pwm {blue_pin} v1
+mils p7
+inr v0
+lda p6
+cmp v0
+jp 0
+'''
 
 
 class LEDController():
@@ -11,10 +47,13 @@ class LEDController():
         red_pin (int): GPIO pin used for the red LED channel.
         green_pin (int): GPIO pin used for the green LED channel.
         blue_pin (int): GPIO pin used for the blue LED channel.
+        daemon_fade (bool): Run fades as a script inside the pigpio
+            daemon and track the current color locally.
 
     """
 
-    def __init__(self, red_pin, green_pin, blue_pin, host=None):
+    def __init__(self, red_pin, green_pin, blue_pin, host=None, port=None,
+                 daemon_fade=False):
         """Connect to Raspberry Pi and initilize the GPIO pins.
 
         Args:
@@ -22,12 +61,24 @@ class LEDController():
             green_pin (int): GPIO pin used for the green LED channel.
             blue_pin (int): GPIO pin used for the blue LED channel.
             host (str): Nme or IP Address of Raspberry Pi.
+            port (int): Port of the pigpio daemon. Uses pigpio's
+                default (PIGPIO_PORT or 8888) if None.
+            daemon_fade (bool): Upload the fade to the pigpio daemon as
+                a script instead of setting each interpolation color
+                over the socket. The current color is then tracked
+                locally (shared with forked processes) instead of being
+                read from the daemon. Call `stop_fade` after terminating
+                a process that may be fading.
 
         """
+        # Set before any pigpio call, __del__ needs them if one fails
+        self.daemon_fade = daemon_fade
+        self._script_id = None
+        kwargs = {'port': port} if port else {}
         if host:
-            self.pi = pigpio.pi(host)
+            self.pi = pigpio.pi(host, **kwargs)
         else:
-            self.pi = pigpio.pi()
+            self.pi = pigpio.pi(**kwargs)
         self.red_pin = red_pin
         self.green_pin = green_pin
         self.blue_pin = blue_pin
@@ -35,6 +86,18 @@ class LEDController():
         self.pi.set_PWM_dutycycle(self.green_pin, 0)
         self.pi.set_PWM_dutycycle(self.blue_pin, 0)
 
+        if daemon_fade:
+            # No locks shared across processes, a process terminated
+            # mid-fade must not leave anything locked
+            self._color = Array('i', 3, lock=False)
+            self._fade_lock = threading.Lock()
+            script = FADE_SCRIPT.format(red_pin=red_pin, green_pin=green_pin,
+                                        blue_pin=blue_pin)
+            self._script_id = self.pi.store_script(script.encode())
+            while self.pi.script_status(self._script_id)[0] == \
+                    pigpio.PI_SCRIPT_INITING:
+                sleep(0.01)
+
     def _linear_gradient(self, start, finish, n=40):
         """Returns an interpolation between `start` and `finish` color.
 
@@ -69,6 +132,9 @@ class LEDController():
                 color.
 
         """
+        if self.daemon_fade:
+            self._daemon_fade(r, g, b, delay)
+            return
         r_old, g_old, b_old = self.get_color()
         rgb_list = self._linear_gradient(start=[r_old, g_old, b_old],
                                         finish=[r, g, b])
@@ -78,6 +144,46 @@ class LEDController():
                 self.pi.set_PWM_dutycycle(self.blue_pin, b)
                 sleep(delay)
 
+    def _daemon_fade(self, r, g, b, delay, n=40):
+        """Runs the fade script in the pigpio daemon and waits for it.
+
+        Args:
+            r (int): The new red value.
+            g (int): The new green value.
+            b (int): The new blue value.
+            delay (float): Delay in seconds between each interpolation
+                color.
+            n (int): Number of interpolation points.
+
+        """
+        finish = [int(r), int(g), int(b)]
+        # The script can only run once at a time in this process
+        with self._fade_lock:
+            params = list(self.get_color()) + finish + \
+                [n - 1, int(delay * 1000)]
+            self.pi.run_script(self._script_id, params)
+            # Sleep through the fade locally before asking the daemon
+            sleep(n * delay)
+            while self.pi.script_status(self._script_id)[0] == \
+                    pigpio.PI_SCRIPT_RUNNING:
+                sleep(max(delay, 0.01))
+            self._color[:] = finish
+
+    def stop_fade(self):
+        """Stops a running fade script and reads back the current color.
+
+        Needed when a process was terminated mid-fade, since the script
+        keeps running in the daemon and the tracked color is stale.
+        Does nothing unless `daemon_fade` is enabled.
+
+        """
+        if not self.daemon_fade:
+            return
+        self.pi.stop_script(self._script_id)
+        self._color[:] = [self.pi.get_PWM_dutycycle(self.red_pin),
+                          self.pi.get_PWM_dutycycle(self.green_pin),
+                          self.pi.get_PWM_dutycycle(self.blue_pin)]
+
     def get_color(self):
         """Returns the current color.
 
@@ -85,6 +191,8 @@ class LEDController():
             tuple: (R, G, B). The current color.
 
         """
+        if self.daemon_fade:
+            return tuple(self._color[:])
         r = self.pi.get_PWM_dutycycle(self.red_pin)
         g = self.pi.get_PWM_dutycycle(self.green_pin)
         b = self.pi.get_PWM_dutycycle(self.blue_pin)
@@ -92,4 +200,10 @@ class LEDController():
 
     def __del__(self):
         """Releases pigpio resources."""
+        if self._script_id is not None and self.pi.connected:
+            try:
+                self.pi.delete_script(self._script_id)
+            except Exception:
+                # The socket may already be gone at interpreter exit
+                pass
         self.pi.stop()
@@ -0,0 +1,176 @@
+import os
+import sys
+import pstats
+import cProfile
+import threading
+import multiprocessing
+from time import time
+from collections import Counter
+
+
+class LoopProfiler():
+    """Profiles a bounded number of iterations of the daemon loop.
+
+    Each profiled iteration is written to `output_dir` as a cProfile
+    dump (`.prof`, readable with pstats or snakeviz) and/or as
+    collapsed stacks (`.collapsed`, readable with flamegraph.pl or
+    speedscope). The state is kept in shared memory so the profiler
+    can be toggled from another process, e.g. the web app. When the
+    profiler is disabled, `begin` and `end` only check a flag.
+
+    The analysis may run in other threads, e.g. the k-means clustering
+    of the progressive mode. The sampler therefore samples every thread,
+    with the thread name as the root of its stacks, and cProfile also
+    follows the threads started during the iteration.
+
+    Attributes:
+        output_dir (str): Directory the profiles are written to.
+        mode (str): 'deterministic', 'sampling' or 'both'.
+        interval (float): Seconds between stack samples.
+
+    """
+
+    def __init__(self, output_dir='profiles', mode='both', interval=0.005):
+        """Initializes a disabled profiler.
+
+        Args:
+            output_dir (str): Directory the profiles are written to.
+            mode (str): 'deterministic' to use cProfile, 'sampling' to
+                sample the stack every `interval` seconds or 'both'.
+            interval (float): Seconds between stack samples.
+
+        Raises:
+            ValueError: If `mode` is not a supported mode.
+
+        """
+        if mode not in ('deterministic', 'sampling', 'both'):
+            raise ValueError('Invalid mode. Only deterministic, sampling '\
+                             'and both supported.')
+        self.output_dir = output_dir
+        self.mode = mode
+        self.interval = interval
+        self._active = multiprocessing.Event()
+        self._tracks_left = multiprocessing.Value('i', 0)
+        self._deadline = multiprocessing.Value('d', 0)
+        self._iteration = 0
+        self._profile = None
+        self._thread_profiles = []
+        self._sampler = None
+
+    def enable(self, tracks=None, seconds=None):
+        """Starts profiling for a bounded window.
+
+        Profiling stops after `tracks` track changes or `seconds`
+        seconds, whichever comes first. Without bounds it runs until
+        `disable` is called.
+
+        Args:
+            tracks (int): Number of track changes to profile.
+            seconds (float): Number of seconds to profile.
+
+        """
+        self._tracks_left.value = tracks or 0
+        self._deadline.value = time() + seconds if seconds else 0
+        self._active.set()
+
+    def disable(self):
+        """Stops profiling after the current iteration."""
+        self._active.clear()
+
+    def is_enabled(self):
+        """Returns True if the profiler is enabled."""
+        return self._active.is_set()
+
+    def begin(self):
+        """Starts profiling an iteration if the profiler is enabled."""
+        if not self._active.is_set():
+            return
+        if self.mode != 'sampling':
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+            threading.setprofile(self._profile_thread)
+        if self.mode != 'deterministic':
+            self._sampler = _StackSampler(self.interval)
+            self._sampler.start()
+
+    def _profile_thread(self, frame, event, arg):
+        """Starts a cProfile of its own in a new thread."""
+        sys.setprofile(None)
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Since Python 3.12 the first profile follows every thread
+            return
+        self._thread_profiles.append(profile)
+
+    def end(self, track_change=False):
+        """Stops profiling the iteration and writes its profiles.
+
+        Args:
+            track_change (bool): True if the iteration handled a track
+                change, counted towards the `tracks` bound.
+
+        """
+        if self._profile is None and self._sampler is None:
+            return
+        os.makedirs(self.output_dir, exist_ok=True)
+        # The pid keeps a restarted loop from overwriting earlier profiles
+        path = os.path.join(self.output_dir, '{}-{:05d}-{}'.format(
+            os.getpid(), self._iteration,
+            'track' if track_change else 'poll'))
+        self._iteration += 1
+
+        if self._profile is not None:
+            threading.setprofile(None)
+            self._profile.disable()
+            stats = pstats.Stats(self._profile)
+            if self._thread_profiles:
+                stats.add(*self._thread_profiles)
+            stats.dump_stats(path + '.prof')
+            self._profile = None
+            self._thread_profiles = []
+        if self._sampler is not None:
+            self._sampler.stop()
+            with open(path + '.collapsed', 'w') as f:
+                for stack, count in self._sampler.counts.items():
+                    f.write('{} {}\n'.format(stack, count))
+            self._sampler = None
+
+        with self._tracks_left.get_lock():
+            if track_change and self._tracks_left.value > 0:
+                self._tracks_left.value -= 1
+                if self._tracks_left.value == 0:
+                    self.disable()
+        if self._deadline.value and time() >= self._deadline.value:
+            self.disable()
+
+
+class _StackSampler(threading.Thread):
+    """Samples the stacks of all threads and counts the collapsed stacks."""
+
+    def __init__(self, interval):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.counts = Counter()
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.wait(self.interval):
+            names = {thread.ident: thread.name
+                     for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == self.ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append('{}:{}'.format(
+                        os.path.basename(code.co_filename), code.co_name))
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.counts[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self._done.set()
+        self.join()
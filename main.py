@@ -2,9 +2,13 @@ import os
 import sys
 import argparse
 import configparser
-from time import sleep
+import numpy as np
+from time import sleep, perf_counter
+from concurrent.futures import ThreadPoolExecutor
 from current_spotify_playback import CurrentSpotifyPlayback, NoArtworkException
-from spotify_background_color import SpotifyBackgroundColor
+from spotify_background_color import SpotifyBackgroundColor, lab_lookup_table
+from loop_profiler import LoopProfiler
+from quality_governor import QualityGovernor
 
 
 CLIENT_ID = os.environ.get('SPOTIPY_CLIENT_ID')
@@ -12,7 +16,89 @@ CLIENT_SECRET = os.environ.get('SPOTIPY_CLIENT_SECRET')
 REDIRECT_URI = os.environ.get('SPOTIPY_REDIRECT_URI')
 REFRESH_TOKEN = os.environ.get('SPOTIPY_REFRESH_TOKEN')
 
-def main(k, color_tol, size):
+def full_color(spotify, k, color_tol, size, worker=None, governor=None,
+               color_space='RGB'):
+    """Returns the background color of the full quality artwork.
+
+    Args:
+        spotify (CurrentSpotifyPlayback): The current playback.
+        k (int): Number of clusters to form.
+        color_tol (float): Tolerance for a colorful color.
+        size (tuple): Size of the artwork used for the analysis.
+        worker (AnalysisWorker): Worker process to run the analysis in.
+            The analysis runs in this process if None.
+        governor (QualityGovernor): Chooses the analysis settings
+            instead of `k` and `size` if given.
+        color_space (str): Color space to cluster in, either RGB or Lab.
+
+    Returns:
+        tuple: (R, G, B). The calculated background color.
+
+    """
+    try:
+        artwork = spotify.get_artwork()
+        if governor:
+            return governor.best_color(artwork, color_tol, worker)
+        if worker:
+            return worker.best_color(artwork, k=k, color_tol=color_tol,
+                                     image_processing_size=size,
+                                     color_space=color_space)
+        background_color = SpotifyBackgroundColor(
+            img=artwork, image_processing_size=size)
+        return background_color.best_color(k=k, color_tol=color_tol,
+                                           color_space=color_space)
+    except NoArtworkException:
+        return 255, 255, 255
+
+
+def progressive_color(spotify, led, k, color_tol, size, min_diff,
+                      worker=None, governor=None, color_space='RGB'):
+    """Sets a coarse color at once and the full quality color afterward.
+
+    The coarse color is computed from the smallest artwork variant.
+    While the LED-strip fades to it, the full quality color is computed
+    in the background and set if it differs by more than `min_diff`.
+    The time to the first and to the final color are printed.
+
+    Args:
+        spotify (CurrentSpotifyPlayback): The current playback.
+        led: The LED controller.
+        k (int): Number of clusters to form.
+        color_tol (float): Tolerance for a colorful color.
+        size (tuple): Size of the artwork used for the full analysis.
+        min_diff (float): Minimum Euclidean RGB distance between the
+            coarse and the full quality color to update the LED-strip.
+        worker (AnalysisWorker): Worker process to run the full quality
+            analysis in.
+        governor (QualityGovernor): Chooses the settings of the full
+            quality analysis.
+        color_space (str): Color space to cluster in, either RGB or Lab.
+
+    """
+    start = perf_counter()
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(full_color, spotify, k, color_tol, size,
+                                 worker, governor, color_space)
+        try:
+            artwork = spotify.get_artwork(smallest=True)
+            coarse = SpotifyBackgroundColor(img=artwork).coarse_color(
+                color_tol=color_tol)
+        except NoArtworkException:
+            coarse = 255, 255, 255
+        first = perf_counter() - start
+        led.set_color(*coarse)
+        final = future.result()
+
+    diff = np.linalg.norm(np.subtract(final, coarse, dtype='float'))
+    if diff > min_diff:
+        led.set_color(*final)
+    print('Time to first color: {:.0f} ms, time to final color: {:.0f} ms '\
+          '({})'.format(first * 1000, (perf_counter() - start) * 1000,
+                        'updated' if diff > min_diff else 'kept'))
+
+
+def main(k, color_tol, size, profiler=None, progressive=False, min_diff=30,
+         use_worker=False, budget=None, color_space='RGB'):
     """Sets the LED-strip to a suitable color for the current artwork.
 
     Args:
@@ -25,6 +111,16 @@ def main(k, color_tol, size):
             int - Percentage of current size.
             float - Fraction of current size.
             tuple - Size of the output image.
+        profiler (LoopProfiler): Profiles the loop if enabled.
+        progressive (bool): Set a coarse color from the smallest
+            artwork before the full quality color.
+        min_diff (float): Minimum RGB distance between the coarse and
+            full quality color to update the LED-strip.
+        use_worker (bool): Run the analysis in a persistent worker
+            process.
+        budget (float): Latency budget in seconds. If given, `k` and
+            `size` are lowered when the analysis is too slow.
+        color_space (str): Color space to cluster in, either RGB or Lab.
 
     """
     config = configparser.ConfigParser()
@@ -56,36 +152,57 @@ def main(k, color_tol, size):
         red_pin = int(GPIO_PINS['red_pin'])
         green_pin = int(GPIO_PINS['green_pin'])
         blue_pin = int(GPIO_PINS['blue_pin'])
-        led = LEDController(red_pin, green_pin, blue_pin)
+        daemon_fade = GPIO_PINS.get('daemon_fade') == 'True'
+        led = LEDController(red_pin, green_pin, blue_pin,
+                            daemon_fade=daemon_fade)
     name = config['CHROMECAST']['name']
 
     spotify = CurrentSpotifyPlayback(CLIENT_ID, CLIENT_SECRET,
                                      REDIRECT_URI, REFRESH_TOKEN)
 
+    if profiler is None:
+        profiler = LoopProfiler()
+    if color_space == 'Lab':
+        # Build the table before the first track is timed
+        lab_lookup_table()
+    worker = None
+    if use_worker:
+        # Shared memory needs Python 3.8, so only import it when asked for
+        from analysis_worker import AnalysisWorker
+        worker = AnalysisWorker(lab=color_space == 'Lab')
+    governor = QualityGovernor(k, size, budget, color_space=color_space) \
+        if budget else None
+
     old_song_id = ''
     try:
         while True:
+            profiler.begin()
+            track_change = False
             spotify.update_current_playback()
             if spotify.connected_to_chromecast(name):
                 if spotify.new_song(old_song_id):
-                    try:
-                        artwork = spotify.get_artwork()
-                        background_color = SpotifyBackgroundColor(
-                            img=artwork, image_processing_size=size)
-                        r, g, b = background_color.best_color(
-                            k=k, color_tol=color_tol)
-                    except NoArtworkException:
-                        r, g, b = 255, 255, 255
-                    led.set_color(r, g, b)
+                    track_change = True
+                    if progressive:
+                        progressive_color(spotify, led, k, color_tol, size,
+                                          min_diff, worker, governor,
+                                          color_space)
+                    else:
+                        r, g, b = full_color(spotify, k, color_tol, size,
+                                             worker, governor, color_space)
+                        led.set_color(r, g, b)
                     old_song_id = spotify.get_current_song_id()
             else:
                 old_song_id = ''
                 r, g, b = led.get_color()
                 if r != 0 or g != 0 or b != 0:
                     led.set_color(0, 0, 0)
+            profiler.end(track_change)
             sleep(2)
     except KeyboardInterrupt:
         led.set_color(0, 0, 0)
+    finally:
+        if worker:
+            worker.close()
 
 
 if __name__ == '__main__':
@@ -98,6 +215,36 @@ if __name__ == '__main__':
                         default=0, help='tolerance for a colorful color')
     parser.add_argument('-s', '--size', metavar='SIZE', type=int, nargs='+',
                         default=(100, 100), help='artwork width and height to use as a tuple')
+    parser.add_argument('-p', '--progressive', action='store_true',
+                        help='set a coarse color from the smallest artwork '\
+                        'before the full quality color')
+    parser.add_argument('--min-diff', metavar='DISTANCE', type=float,
+                        default=30, help='minimum RGB distance between the '\
+                        'coarse and full quality color to update the color')
+    parser.add_argument('-w', '--worker', action='store_true',
+                        help='run the analysis in a persistent worker process')
+    parser.add_argument('-c', '--color-space', default='RGB',
+                        choices=['RGB', 'Lab'], help='color space used in '\
+                        'the k-means clustering')
+    parser.add_argument('-b', '--budget', metavar='MILLISECONDS', type=float,
+                        default=None, help='latency budget of the analysis, '\
+                        'lowers the quality when exceeded')
+    parser.add_argument('--profile', metavar='TRACKS', type=int, nargs='?',
+                        const=5, default=None, help='profile the loop for '\
+                        'the given number of track changes')
+    parser.add_argument('--profile-seconds', metavar='SECONDS', type=float,
+                        default=None, help='profile the loop for the given '\
+                        'number of seconds')
+    parser.add_argument('--profile-mode', default='both',
+                        choices=['deterministic', 'sampling', 'both'],
+                        help='use cProfile, stack sampling or both')
+    parser.add_argument('--profile-dir', metavar='DIR', default='profiles',
+                        help='directory the profiles are written to')
 
     args = parser.parse_args()
-    main(args.cluster, args.tol, tuple(args.size))
+    profiler = LoopProfiler(args.profile_dir, args.profile_mode)
+    if args.profile is not None or args.profile_seconds is not None:
+        profiler.enable(tracks=args.profile, seconds=args.profile_seconds)
+    main(args.cluster, args.tol, tuple(args.size), profiler,
+         args.progressive, args.min_diff, args.worker,
+         args.budget / 1000 if args.budget else None, args.color_space)
@@ -0,0 +1,234 @@
+import os
+import numpy as np
+from collections import deque
+from time import perf_counter
+from spotify_background_color import SpotifyBackgroundColor
+
+
+class QualityGovernor():
+    """Adapts the analysis settings to stay within a latency budget.
+
+    The governor walks a ladder of quality levels, from the configured
+    number of clusters and image size down to smaller images, fewer
+    clusters and finally the histogram estimate of `coarse_color`. It
+    decides on the median of the last `window` latencies at the current
+    level, so a single slow track neither drops the quality nor keeps it
+    from being raised again. It steps down, to the first level expected
+    to fit, when the median exceeds the budget or comes close to it
+    while the system is loaded. It steps back up when the median has
+    stayed well below the budget for `patience` track changes and the
+    better level is expected to fit the budget. The median last measured
+    at a level is trusted for `retry` track changes.
+
+    Attributes:
+        levels (list): (k, image_processing_size, strategy) tuples,
+            from the best to the cheapest quality.
+        level (int): Index of the current level in `levels`.
+        budget (float): Latency budget in seconds.
+        color_space (str): Color space to cluster in.
+        latency (float): Median of the recent latencies at the current
+            level in seconds.
+
+    """
+
+    def __init__(self, k, size, budget, window=3, headroom=0.5,
+                 max_load=1.0, patience=3, retry=20, color_space='RGB'):
+        """Initializes the governor at the configured quality.
+
+        Args:
+            k (int): Number of clusters of the best quality.
+            size (tuple): Image size of the best quality.
+            budget (float): Latency budget in seconds.
+            window (int): Number of latencies measured at a level
+                before it is judged.
+            headroom (float): Fraction of the budget the latency must
+                stay below to step up.
+            max_load (float): One minute load average per CPU above
+                which the system is considered loaded.
+            patience (int): Number of track changes below the headroom
+                before stepping up.
+            retry (int): Number of track changes the latency measured
+                at a level is used for, before the level may be tried
+                again.
+            color_space (str): Color space to cluster in, either RGB
+                or Lab.
+
+        """
+        self.levels = self._quality_levels(k, size)
+        self.level = 0
+        self.budget = budget
+        self.window = window
+        self.headroom = headroom
+        self.max_load = max_load
+        self.patience = patience
+        self.retry = retry
+        self.color_space = color_space
+        self.latency = None
+        self._samples = deque(maxlen=window)
+        self._streak = 0
+        self._updates = 0
+        self._measured = {}
+
+    def _quality_levels(self, k, size):
+        """Returns the quality ladder for the configured settings.
+
+        Args:
+            k (int): Number of clusters of the best quality.
+            size (tuple): Image size of the best quality.
+
+        Returns:
+            list: (k, image_processing_size, strategy) tuples.
+
+        """
+        levels = []
+        for k_scale, size_scale in ((1, 1), (0.75, 0.75), (0.5, 0.5),
+                                    (0.5, 0.3)):
+            level = (max(2, int(round(k * k_scale))),
+                     (max(8, int(size[0] * size_scale)),
+                      max(8, int(size[1] * size_scale))),
+                     'kmeans')
+            if level not in levels:
+                levels.append(level)
+        levels.append((k, levels[-1][1], 'coarse'))
+        return levels
+
+    def settings(self):
+        """Returns the current settings.
+
+        Returns:
+            tuple: (k, image_processing_size, strategy).
+
+        """
+        return self.levels[self.level]
+
+    def best_color(self, img, color_tol, worker=None):
+        """Returns the background color using the current settings.
+
+        Args:
+            img (ndarray): The image to analyze.
+            color_tol (float): Tolerance for a colorful color.
+            worker (AnalysisWorker): Worker process to run the k-means
+                clustering in.
+
+        Returns:
+            tuple: (R, G, B). The calculated background color.
+
+        """
+        k, size, strategy = self.settings()
+        start = perf_counter()
+        if strategy == 'coarse':
+            background_color = SpotifyBackgroundColor(
+                img=img, image_processing_size=size)
+            color = background_color.coarse_color(n_colors=k,
+                                                  color_tol=color_tol)
+        elif worker:
+            color = worker.best_color(img, k=k, color_tol=color_tol,
+                                      image_processing_size=size,
+                                      color_space=self.color_space)
+        else:
+            background_color = SpotifyBackgroundColor(
+                img=img, image_processing_size=size)
+            color = background_color.best_color(
+                k=k, color_tol=color_tol, color_space=self.color_space)
+        self.update(perf_counter() - start)
+        return color
+
+    def update(self, latency):
+        """Records a latency and changes the level if needed.
+
+        Args:
+            latency (float): Latency of the last analysis in seconds.
+
+        """
+        self._updates += 1
+        self._samples.append(latency)
+        self.latency = float(np.median(self._samples))
+        if len(self._samples) < self.window:
+            return
+        self._measured[self.level] = (self.latency, self._updates)
+        loaded = os.getloadavg()[0] / os.cpu_count() > self.max_load
+        limit = 0.75 * self.budget if loaded else self.budget
+
+        if self.latency > limit:
+            self._change_level(self._cheaper_level(limit), loaded)
+        elif self.latency < self.headroom * self.budget and not loaded:
+            self._streak += 1
+            if self._streak >= self.patience and self.level > 0 and \
+                    self._fits(self.level - 1):
+                self._change_level(self.level - 1, loaded)
+        else:
+            self._streak = 0
+
+    def _fits(self, level):
+        """Returns True if `level` is expected to stay within the budget.
+
+        Uses the latency last measured at `level` if it is recent.
+        Otherwise it is estimated from the current latency by the
+        k-means work. The histogram estimate has no comparable work, so
+        from there a level is only tried again once its measurement has
+        expired.
+
+        """
+        if level in self._measured:
+            latency, update = self._measured[level]
+            if self._updates - update < self.retry:
+                return latency < self.budget
+        if self.settings()[2] == 'coarse':
+            return True
+        return self._expected_latency(level) < self.budget
+
+    def _cheaper_level(self, limit):
+        """Returns the best cheaper level expected to stay below `limit`.
+
+        Falls back to the histogram estimate if no k-means level is
+        expected to fit.
+
+        """
+        for level in range(self.level + 1, len(self.levels) - 1):
+            if self._expected_latency(level) < limit:
+                return level
+        return len(self.levels) - 1
+
+    def _work(self, level):
+        """Returns the k-means work of a level relative to the best one.
+
+        k-means does work proportional to the number of pixels and
+        clusters.
+
+        """
+        k, size, strategy = self.levels[level]
+        best_k, best_size, _ = self.levels[0]
+        return (k * size[0] * size[1]) / (best_k * best_size[0] * best_size[1])
+
+    def _expected_latency(self, level):
+        """Returns the latency expected at `level` from the current one."""
+        return self.latency * self._work(level) / self._work(self.level)
+
+    def _change_level(self, level, loaded):
+        """Switches to `level` and reports it."""
+        self._streak = 0
+        if level == self.level:
+            return
+        latency = self.latency
+        self.level = level
+        # The samples belong to the old settings, start over
+        self.latency = None
+        self._samples.clear()
+        print('Quality governor: {:.0f} ms median against a {:.0f} ms '\
+              'budget{}, switching to {}'.format(
+                  latency * 1000, self.budget * 1000,
+                  ' on a loaded system' if loaded else '', self.report()))
+
+    def report(self):
+        """Returns a description of the current quality trade-off.
+
+        Returns:
+            str: The current settings and their cost relative to the
+                configured settings.
+
+        """
+        k, size, strategy = self.settings()
+        if strategy == 'coarse':
+            return 'histogram estimate of {}x{} px (no k-means)'.format(*size)
+        return 'k = {}, {}x{} px ({:.0f} % of the configured work)'.format(
+            k, size[0], size[1], self._work(self.level) * 100)
@@ -5,6 +5,63 @@ from sklearn.cluster import KMeans
 from PIL import Image
 
 
+# Bits kept per channel when looking up the CIELAB value of a color
+LAB_LUT_BITS = 6
+_lab_luts = {}
+
+
+def rgb_to_lab(rgb):
+    """Converts sRGB colors to CIELAB (D65 white point).
+
+    Args:
+        rgb (ndarray): Colors as rows of (R, G, B) in [0, 255].
+
+    Returns:
+        ndarray: Colors as rows of (L, a, b).
+
+    """
+    rgb = np.asarray(rgb, dtype='float') / 255
+    linear = np.where(rgb <= 0.04045, rgb / 12.92,
+                      ((rgb + 0.055) / 1.055) ** 2.4)
+    xyz = linear @ np.array([[0.4124, 0.3576, 0.1805],
+                             [0.2126, 0.7152, 0.0722],
+                             [0.0193, 0.1192, 0.9505]]).T
+    xyz /= np.array([0.95047, 1.0, 1.08883])
+
+    delta = 6 / 29
+    f = np.where(xyz > delta ** 3, np.cbrt(xyz),
+                 xyz / (3 * delta ** 2) + 4 / 29)
+    return np.stack([116 * f[:, 1] - 16,
+                     500 * (f[:, 0] - f[:, 1]),
+                     200 * (f[:, 1] - f[:, 2])], axis=1)
+
+
+def lab_lookup_table(bits=LAB_LUT_BITS):
+    """Returns a table of the CIELAB value of every quantized RGB color.
+
+    The table is built once per process and kept in memory.
+
+    Args:
+        bits (int): Bits kept per channel. The table has 2**(3*bits)
+            rows, 6 bits gives 262144 rows or 3 MB.
+
+    Returns:
+        ndarray: (L, a, b) of the color with index
+            (r << 2*bits) | (g << bits) | b of the quantized channels.
+
+    """
+    if bits in _lab_luts:
+        return _lab_luts[bits]
+    # Use the mean of the 8-bit values in each quantization bin
+    step = 2 ** (8 - bits)
+    values = np.arange(2 ** bits) * step + (step - 1) / 2
+    r, g, b = np.meshgrid(values, values, values, indexing='ij')
+    rgb = np.stack([r.ravel(), g.ravel(), b.ravel()], axis=1)
+    table = rgb_to_lab(rgb).astype('float32')
+    _lab_luts[bits] = table
+    return table
+
+
 class SpotifyBackgroundColor():
     """Analyzes an image and finds a fitting background color.
 
@@ -13,6 +70,9 @@ class SpotifyBackgroundColor():
 
     Attributes:
         img (ndarray): The image to analyze.
+        centroids (ndarray): Cluster colors found by the last call to
+            `best_color`.
+        hist (ndarray): Relative size of each cluster in `centroids`.
 
     """
 
@@ -41,7 +101,10 @@ class SpotifyBackgroundColor():
             img = Image.fromarray(self.img)
             self.img = np.asarray(img.resize(image_processing_size, Image.BILINEAR))
 
-    def best_color(self, k=8, color_tol=10, plot=False):
+        self.centroids = None
+        self.hist = None
+
+    def best_color(self, k=8, color_tol=10, plot=False, color_space='RGB'):
         """Returns a suitable background color for the given image.
 
         Uses k-means clustering to find `k` distinct colors in
@@ -60,18 +123,37 @@ class SpotifyBackgroundColor():
                 record/33994/files/HaslerS03.pdf.
             plot (bool): Plot the original image, k-means result and
                 calculated background color. Only used for testing.
+            color_space (str): Color space to cluster in, either RGB
+                or Lab. Lab separates perceptually different colors
+                better, so a lower `k` can be used.
 
         Returns:
             tuple: (R, G, B). The calculated background color.
 
+        Raises:
+            ValueError: If `color_space` is not RGB or Lab.
+
         """
+        if color_space not in ('RGB', 'Lab'):
+            raise ValueError('Invalid color space. Only RGB and Lab '\
+                             'color space supported.')
         artwork = self.img.copy()
         self.img = self.img.reshape((self.img.shape[0]*self.img.shape[1], 3))
 
         clt = KMeans(n_clusters=k)
-        clt.fit(self.img)
+        if color_space == 'Lab':
+            clt.fit(self.lab_pixels())
+            # Map each cluster back to the mean RGB color of its pixels
+            counts = np.maximum(np.bincount(clt.labels_, minlength=k), 1)
+            centroids = np.stack(
+                [np.bincount(clt.labels_, weights=self.img[:, i],
+                             minlength=k) / counts for i in range(3)], axis=1)
+        else:
+            clt.fit(self.img)
+            centroids = clt.cluster_centers_
         hist = self.find_histogram(clt)
-        centroids = clt.cluster_centers_
+        self.centroids = centroids
+        self.hist = hist
 
         colorfulness = [self.colorfulness(color[0], color[1], color[2]) for color in centroids]
         max_colorful = np.max(colorfulness)
@@ -117,6 +199,75 @@ class SpotifyBackgroundColor():
 
         return best_color[0], best_color[1], best_color[2]
 
+    def coarse_color(self, n_colors=8, color_tol=10, levels=8):
+        """Returns a quick estimate of the background color.
+
+        Instead of k-means clustering, each channel is quantized into
+        `levels` bins and the `n_colors` most common bins are used as
+        the candidate colors. The most colorful candidate is returned
+        with the same tolerance as in `best_color`. Meant to be used
+        on a small image to get a color out before `best_color` is done.
+
+        Args:
+            n_colors (int): Number of candidate colors.
+            color_tol (float): Tolerance for a colorful color.
+            levels (int): Number of quantization levels per channel.
+
+        Returns:
+            tuple: (R, G, B). The estimated background color.
+
+        """
+        pixels = self.img.reshape((-1, 3)).astype('float')
+        bins = (pixels * levels / 256).astype('int')
+        labels = (bins[:, 0] * levels + bins[:, 1]) * levels + bins[:, 2]
+        counts = np.bincount(labels, minlength=levels ** 3)
+        top = np.argsort(counts)[::-1][:n_colors]
+        top = top[counts[top] > 0]
+
+        # Mean color of the pixels in each of the most common bins
+        candidates = [pixels[labels == label].mean(axis=0) for label in top]
+        colorfulness = [self.colorfulness(color[0], color[1], color[2])
+                        for color in candidates]
+
+        if np.max(colorfulness) < color_tol:
+            best_color = [230, 230, 230]
+        else:
+            best_color = candidates[np.argmax(colorfulness)]
+
+        return int(best_color[0]), int(best_color[1]), int(best_color[2])
+
+    def palette(self):
+        """Returns the colors found by the last call to `best_color`.
+
+        Returns:
+            list: (R, G, B, percent) tuples sorted by cluster size,
+                largest first. Empty if `best_color` has not been
+                called.
+
+        """
+        if self.centroids is None:
+            return []
+        palette = [(int(color[0]), int(color[1]), int(color[2]), float(percent))
+                   for (percent, color) in zip(self.hist, self.centroids)]
+        return sorted(palette, key=lambda c: c[3], reverse=True)
+
+    def lab_pixels(self, bits=LAB_LUT_BITS):
+        """Returns the pixels of the image in CIELAB.
+
+        Looks the colors up in `lab_lookup_table`, which costs a single
+        gather per image instead of a conversion of every pixel.
+
+        Args:
+            bits (int): Bits kept per channel in the lookup.
+
+        Returns:
+            ndarray: Pixels as rows of (L, a, b).
+
+        """
+        rgb = self.img.reshape((-1, 3)).astype('int32') >> (8 - bits)
+        index = (rgb[:, 0] << 2 * bits) | (rgb[:, 1] << bits) | rgb[:, 2]
+        return lab_lookup_table(bits)[index]
+
     def find_histogram(self, clt):
         """Create a histogram of image.
 